@@ -0,0 +1,80 @@
+import asyncio
+from contextlib import suppress
+from datetime import datetime
+
+from cachetools import TTLCache
+from redis import Redis
+
+from app.config import LOCAL_CACHE_MAXSIZE, LOCAL_CACHE_TTL_SECONDS
+from app.redis import create_async_redis
+
+# Process-local cache in front of Redis: alias popularity is Zipfian, so a
+# small hot set answers most redirects with a dict lookup instead of a Redis
+# round-trip. Entries expire quickly and workers invalidate each other over
+# a pub/sub channel on update/delete.
+
+INVALIDATE_CHANNEL = "link-invalidate"
+
+_local_links = TTLCache(maxsize=LOCAL_CACHE_MAXSIZE, ttl=LOCAL_CACHE_TTL_SECONDS)
+
+
+def local_get(link_id: str):
+    entry = _local_links.get(link_id)
+
+    if entry is None:
+        return None
+
+    url, expire_at = entry
+
+    # The cache TTL only bounds staleness; a link may expire sooner than that
+    if expire_at <= datetime.now():
+        local_drop(link_id)
+        return None
+
+    return url
+
+
+def local_put(link_id: str, url: str, expire_at: datetime):
+    _local_links[link_id] = (url, expire_at)
+
+
+def local_drop(link_id: str):
+    _local_links.pop(link_id, None)
+
+
+def publish_invalidation(redis: Redis, link_id: str):
+    """Drop the entry locally and tell the other workers to do the same."""
+    local_drop(link_id)
+    redis.publish(INVALIDATE_CHANNEL, link_id)
+
+
+async def invalidation_listener():
+    while True:
+        try:
+            redis = create_async_redis()
+
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATE_CHANNEL)
+
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            local_drop(message["data"])
+            finally:
+                await redis.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            await asyncio.sleep(5)
+
+
+def start_invalidation_listener() -> asyncio.Task:
+    return asyncio.create_task(invalidation_listener())
+
+
+async def stop_invalidation_listener(task: asyncio.Task):
+    task.cancel()
+
+    with suppress(asyncio.CancelledError):
+        await task
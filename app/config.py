@@ -9,6 +9,16 @@ REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_DATABASE = int(os.getenv("REDIS_DATABASE", default=0))
 
+STATS_FLUSH_SECONDS = int(os.getenv("STATS_FLUSH_SECONDS", default=30))
+
+LOCAL_CACHE_MAXSIZE = int(os.getenv("LOCAL_CACHE_MAXSIZE", default=10_000))
+LOCAL_CACHE_TTL_SECONDS = int(os.getenv("LOCAL_CACHE_TTL_SECONDS", default=60))
+
+THREAD_LIMITER_TOKENS = int(os.getenv("THREAD_LIMITER_TOKENS", default=40))
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", default=12))
+SALT_RING_SIZE = int(os.getenv("SALT_RING_SIZE", default=1024))
+
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", default="HS256")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_EXPIRATION_SECONDS = int(os.getenv("JWT_EXPIRATION_SECONDS", default=3600))
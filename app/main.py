@@ -1,29 +1,55 @@
+import time
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Optional
 from datetime import datetime, timedelta
 
-from bcrypt import checkpw, hashpw, gensalt
+import anyio.to_thread
+from bcrypt import checkpw, hashpw
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import Response, RedirectResponse
-from jose import jwt, JWTError
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, RedirectResponse
+import jwt
+import msgspec
+from pydantic import BaseModel, Field
+from sqlalchemy import insert, select, update, func, lambda_stmt
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, raiseload
 from redis import Redis
 
-from app.config import JWT_EXPIRATION_SECONDS, JWT_SECRET_KEY, JWT_ALGORITHM
+from app.cache import local_get, local_put, publish_invalidation, \
+    start_invalidation_listener, stop_invalidation_listener
+from app.config import JWT_EXPIRATION_SECONDS, JWT_SECRET_KEY, JWT_ALGORITHM, THREAD_LIMITER_TOKENS
 from app.redis import get_redis
-from app.sql import init_db, get_db, User, Link
+from app.sql import init_db, close_db, get_db, User, Link
+from app.stats import record_access, pending_stats, start_stats_flusher, stop_stats_flusher
+from app.utils import generate_short_code, take_salt, start_salt_ring, stop_salt_ring
+
+# Encode the HMAC key once instead of converting it from UTF-8 on every request
+_JWT_SECRET_KEY = JWT_SECRET_KEY.encode() if JWT_SECRET_KEY else None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db()
+    # Cap how many worker threads may run blocking calls (bcrypt) at once
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_LIMITER_TOKENS
+
+    await init_db()
+
+    stats_flusher = start_stats_flusher()
+    invalidation_listener = start_invalidation_listener()
+    salt_ring = start_salt_ring()
 
     yield
 
+    await stop_salt_ring(salt_ring)
+    await stop_invalidation_listener(invalidation_listener)
+    await stop_stats_flusher(stats_flusher)
+    await close_db()
 
-app = FastAPI(lifespan=lifespan)
+
+# orjson encodes responses (datetimes included) in C instead of json.dumps
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 #
@@ -40,17 +66,18 @@ class AuthRegisterResponse(BaseModel):
 
 
 @app.post("/auth/register")
-async def auth_register(request: AuthRegisterRequest, db: Session = Depends(get_db)):
-    password_hash = hashpw(request.password.encode(), salt=gensalt()).decode()
+async def auth_register(request: AuthRegisterRequest, db: AsyncSession = Depends(get_db)):
+    # bcrypt takes tens of ms per call, run it off the event loop
+    password_hash = (await anyio.to_thread.run_sync(hashpw, request.password.encode(), take_salt())).decode()
 
     user = User(nickname=request.username, password_hash=password_hash)
 
     try:
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
 
         raise HTTPException(status_code=409, detail="User with this username already exists")
 
@@ -67,13 +94,13 @@ class AuthTokenResponse(BaseModel):
 
 
 @app.post("/auth/token", response_model=AuthTokenResponse)
-async def auth_token(request: AuthTokenRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.nickname == request.username).first()
+async def auth_token(request: AuthTokenRequest, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(User).where(User.nickname == request.username))).scalar_one_or_none()
 
     if user is None:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
 
-    if not checkpw(request.password.encode(), user.password_hash.encode()):
+    if not await anyio.to_thread.run_sync(checkpw, request.password.encode(), user.password_hash.encode()):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
 
     claims = {
@@ -81,7 +108,7 @@ async def auth_token(request: AuthTokenRequest, db: Session = Depends(get_db)):
         "exp": int((datetime.now() + timedelta(seconds=JWT_EXPIRATION_SECONDS)).timestamp())
     }
 
-    access_token = jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    access_token = jwt.encode(claims, _JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
     return AuthTokenResponse(access_token=access_token)
 
@@ -90,21 +117,45 @@ async def auth_token(request: AuthTokenRequest, db: Session = Depends(get_db)):
 # Links
 #
 
-def get_user_id(request: Request, jwt_secret_key=JWT_SECRET_KEY, jwt_algorithm=JWT_ALGORITHM):
+# Stateless, so single instances can be raised for every request
+_TOKEN_MALFORMED = HTTPException(status_code=401, detail="Access token malformed")
+_TOKEN_EXPIRED = HTTPException(status_code=401, detail="Access token expired")
+
+
+@lru_cache(maxsize=4096)
+def _decode_token(access_token, jwt_secret_key, jwt_algorithm):
+    """Verify the token signature once and memoize its (sub, exp) claims.
+
+    Tokens are HMAC-signed and therefore unforgeable, so the raw token is a
+    safe cache key. Expiry is deliberately not verified here: the caller
+    checks exp on every call, cached or not, so an expired token yields the
+    same 401 regardless of cache state.
+    """
+    claims = jwt.decode(access_token, jwt_secret_key, algorithms=[jwt_algorithm],
+                        options={"verify_exp": False})
+
+    return claims.get("sub"), claims.get("exp")
+
+
+def get_user_id(request: Request):
     header = request.headers.get("Authorization")
 
-    if not header or not header.startswith("Bearer "):
+    # Slicing instead of startswith + split avoids a list allocation per request
+    if not header or header[:7] != "Bearer ":
         return None
 
-    access_token = header.split(" ")[1]
+    access_token = header[7:]
 
     # Check access token
     try:
-        claims = jwt.decode(access_token, jwt_secret_key, algorithms=[jwt_algorithm])
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Access token malformed")
+        user_id, expire_ts = _decode_token(access_token, _JWT_SECRET_KEY, JWT_ALGORITHM)
+    except jwt.PyJWTError:
+        raise _TOKEN_MALFORMED
 
-    return claims.get("sub")
+    if expire_ts is not None and expire_ts <= time.time():
+        raise _TOKEN_EXPIRED
+
+    return user_id
 
 
 def get_user_id_strict(request: Request):
@@ -116,10 +167,23 @@ def get_user_id_strict(request: Request):
     return user_id
 
 
+def cache_link(redis: Redis, link_id: str, url: str, expire_at: datetime, nx: bool = False):
+    """Store the redirect payload with a TTL matching the link expiry.
+
+    With nx=True only the first writer wins, so concurrent cache misses for
+    the same alias do not hammer Redis with duplicate writes.
+    """
+    expire_secs = int((expire_at - datetime.now()).total_seconds())
+
+    if expire_secs > 0:
+        redis.set(f"link:{link_id}", url, ex=expire_secs, nx=nx)
+
+
 class LinksShortenRequest(BaseModel):
     url: str
     expire_at: datetime
-    alias: Optional[str] = None
+    # Aliases share the fixed-width link.id column with generated codes
+    alias: Optional[str] = Field(default=None, max_length=10)
 
 
 class LinksShortenResponse(BaseModel):
@@ -129,29 +193,43 @@ class LinksShortenResponse(BaseModel):
 @app.post("/links/shorten", response_model=LinksShortenResponse)
 async def links_shorten(request: LinksShortenRequest,
                         user_id: Optional[str] = Depends(get_user_id),
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db),
+                        redis: Redis = Depends(get_redis)):
     if request.expire_at < datetime.now():
         raise HTTPException(status_code=400, detail="expire_at must be in the future")
 
-    link = Link(user_id=user_id, url=request.url, expire_at=request.expire_at)
-
-    if request.alias:
-        link.id = request.alias
-
-    try:
-        db.add(link)
-        db.commit()
-        db.refresh(link)
-    except IntegrityError:
-        db.rollback()
+    # Single INSERT ... RETURNING instead of add + commit + refresh; a collision
+    # on a generated code is retried with a fresh one, not surfaced as a 409
+    for _ in range(3):
+        link_id = request.alias or generate_short_code()
+
+        try:
+            link_id = (await db.execute(
+                insert(Link)
+                .values(id=link_id, user_id=user_id, url=request.url, expire_at=request.expire_at)
+                .returning(Link.id)
+            )).scalar_one()
+            await db.commit()
+
+            break
+        except IntegrityError:
+            await db.rollback()
+
+            if request.alias:
+                raise HTTPException(status_code=409, detail="Alias already exists")
+    else:
+        raise HTTPException(status_code=500, detail="Could not generate a unique short code")
 
-        raise HTTPException(status_code=409, detail="Alias already exists")
+    # Populate the cache up front so the first redirect skips the database
+    cache_link(redis, link_id, request.url, request.expire_at)
 
     # noinspection PyTypeChecker
-    return LinksShortenResponse(id=link.id)
+    return LinksShortenResponse(id=link_id)
 
 
-class LinkDTO(BaseModel):
+# msgspec instead of Pydantic: these DTOs only shuttle our own rows out as
+# JSON, so validation is wasted work and encoding can stay in one C pass
+class LinkDTO(msgspec.Struct):
     id: str
     url: str
     access_count: int
@@ -173,78 +251,129 @@ def map_link_to_dto(link: Link) -> LinkDTO:
     )
 
 
-class LinksListResponse(BaseModel):
+def json_response(payload) -> Response:
+    return Response(msgspec.json.encode(payload), media_type="application/json")
+
+
+# Fetch only the columns the DTO needs (the pk is always included) and fail
+# loudly on accidental lazy loads of the user relationship
+_DTO_LOAD_OPTIONS = (
+    load_only(Link.url, Link.access_count, Link.last_access_at,
+              Link.created_at, Link.updated_at, Link.expire_at),
+    raiseload("*"),
+)
+
+
+class LinksListResponse(msgspec.Struct):
     links: list[LinkDTO]
 
 
-@app.get("/links", response_model=LinksListResponse)
-async def links_list(user_id: str = Depends(get_user_id_strict), db: Session = Depends(get_db)):
-    links = db.query(Link).filter(Link.user_id == user_id).all()
+@app.get("/links")
+async def links_list(user_id: str = Depends(get_user_id_strict), db: AsyncSession = Depends(get_db)):
+    links = (await db.execute(
+        select(Link).options(*_DTO_LOAD_OPTIONS).where(Link.user_id == user_id)
+    )).scalars().all()
 
-    # noinspection PyTypeChecker
-    return LinksListResponse(links=list(map(map_link_to_dto, links)))
+    return json_response(LinksListResponse(links=list(map(map_link_to_dto, links))))
 
 
-class LinksSearchResponse(BaseModel):
+class LinksSearchResponse(msgspec.Struct):
     links: list[LinkDTO]
 
 
-@app.get("/links/search", response_model=LinksSearchResponse)
+@app.get("/links/search")
 async def links_search(original_url: str,
                        user_id: str = Depends(get_user_id_strict),
-                       db: Session = Depends(get_db)):
+                       db: AsyncSession = Depends(get_db)):
     if not original_url:
         raise HTTPException(status_code=400, detail="original_url query parameter is required")
 
-    links = db.query(Link).filter(Link.user_id == user_id, Link.url.contains(original_url)).all()
+    links = (await db.execute(
+        select(Link).options(*_DTO_LOAD_OPTIONS).where(Link.user_id == user_id, Link.url.contains(original_url))
+    )).scalars().all()
 
-    # noinspection PyTypeChecker
-    return LinksSearchResponse(links=list(map(map_link_to_dto, links)))
+    return json_response(LinksSearchResponse(links=list(map(map_link_to_dto, links))))
+
+
+def _redirect_stmt(link_id: str):
+    # lambda_stmt caches the compiled statement by lambda identity, so only
+    # the link_id bind changes between redirects. UPDATE ... RETURNING bumps
+    # the counters and fetches the URL in one round-trip and one WAL record.
+    return lambda_stmt(
+        lambda: update(Link)
+        .where(Link.id == link_id, Link.expire_at > func.now())
+        .values(access_count=Link.access_count + 1, last_access_at=func.now())
+        .returning(Link.url, Link.expire_at)
+        .execution_options(synchronize_session=False)
+    )
 
 
 @app.get("/links/{link_id}")
-async def links_redirect(link_id: str, db: Session = Depends(get_db), redis: Redis = Depends(get_redis)):
-    link_cache_key = f"link:{link_id}"
+async def links_redirect(link_id: str, db: AsyncSession = Depends(get_db), redis: Redis = Depends(get_redis)):
+    # In-process cache first, then Redis, then the database
+    original_url = local_get(link_id)
 
-    cached_url = redis.get(link_cache_key)
-    if cached_url:
-        original_url = cached_url
-    else:
-        link = db.query(Link).filter(Link.id == link_id, Link.expire_at > datetime.now()).first()
+    if original_url is None:
+        # Fetch the TTL alongside the value: the local copy must not outlive
+        # the link's own expiry
+        pipeline = redis.pipeline()
+        pipeline.get(f"link:{link_id}")
+        pipeline.ttl(f"link:{link_id}")
+        cached_url, cached_ttl = pipeline.execute()
+
+        if cached_url:
+            original_url = cached_url
 
-        if link is None:
-            raise HTTPException(status_code=404, detail="Link not found")
+            if cached_ttl > 0:
+                local_put(link_id, original_url, datetime.now() + timedelta(seconds=cached_ttl))
+        else:
+            row = (await db.execute(_redirect_stmt(link_id))).first()
+            await db.commit()
 
-        original_url = link.url
+            if row is None:
+                raise HTTPException(status_code=404, detail="Link not found")
 
-        expire_secs = int((link.expire_at - datetime.now()).total_seconds())
+            original_url, expire_at = row
 
-        # noinspection PyAsyncCall,PyTypeChecker
-        redis.setex(link_cache_key, expire_secs, original_url)
+            # nx: only the first of the concurrent misses for this alias writes
+            cache_link(redis, link_id, original_url, expire_at, nx=True)
+            local_put(link_id, original_url, expire_at)
 
-    # Update stats
-    db.query(Link).filter(Link.id == link_id).update({
-        Link.access_count: Link.access_count + 1,
-        Link.last_access_at: datetime.now()
-    })
-    db.commit()
+            # The UPDATE above already counted this hit
+            # noinspection PyTypeChecker
+            return RedirectResponse(status_code=301, url=original_url)
+
+    # Cache hit: record it in Redis; a background task folds counters into
+    # the database in batches instead of an UPDATE + commit per redirect
+    record_access(redis, link_id)
 
     # Redirect to the original URL with a 301 status code
     # noinspection PyTypeChecker
     return RedirectResponse(status_code=301, url=original_url)
 
 
-@app.get("/links/{link_id}/stats", response_model=LinkDTO)
+@app.get("/links/{link_id}/stats")
 async def links_stats(link_id: str,
                       user_id: str = Depends(get_user_id_strict),
-                      db: Session = Depends(get_db)):
-    link = db.query(Link).filter(Link.id == link_id, Link.user_id == user_id).first()
+                      db: AsyncSession = Depends(get_db),
+                      redis: Redis = Depends(get_redis)):
+    link = (await db.execute(
+        select(Link).options(*_DTO_LOAD_OPTIONS).where(Link.id == link_id, Link.user_id == user_id)
+    )).scalar_one_or_none()
 
     if link is None:
         raise HTTPException(status_code=404, detail="Link not found")
 
-    # noinspection PyTypeChecker
-    return map_link_to_dto(link)
+    dto = map_link_to_dto(link)
+
+    # Merge counters that have not been flushed to the database yet
+    pending_count, pending_last = pending_stats(redis, link_id)
+
+    dto.access_count += pending_count
+    if pending_last is not None:
+        dto.last_access_at = pending_last
+
+    return json_response(dto)
 
 
 class LinkUpdateRequest(BaseModel):
@@ -255,8 +384,11 @@ class LinkUpdateRequest(BaseModel):
 async def links_update(link_id: str,
                        request: LinkUpdateRequest,
                        user_id: str = Depends(get_user_id_strict),
-                       db: Session = Depends(get_db)):
-    link = db.query(Link).filter(Link.id == link_id, Link.user_id == user_id).first()
+                       db: AsyncSession = Depends(get_db),
+                       redis: Redis = Depends(get_redis)):
+    link = (await db.execute(
+        select(Link).where(Link.id == link_id, Link.user_id == user_id)
+    )).scalar_one_or_none()
 
     if link is None:
         raise HTTPException(status_code=404, detail="Link not found")
@@ -264,7 +396,11 @@ async def links_update(link_id: str,
     link.url = request.url
     link.updated_at = datetime.now()
 
-    db.commit()
+    await db.commit()
+
+    # Replace the cached payload with the new URL and drop stale local copies
+    cache_link(redis, link_id, link.url, link.expire_at)
+    publish_invalidation(redis, link_id)
 
     return Response(status_code=204)
 
@@ -272,20 +408,23 @@ async def links_update(link_id: str,
 @app.delete("/links/{link_id}")
 async def links_delete(link_id: str,
                        user_id: str = Depends(get_user_id_strict),
-                       db: Session = Depends(get_db),
+                       db: AsyncSession = Depends(get_db),
                        redis: Redis = Depends(get_redis)):
     link_cache_key = f"link:{link_id}"
 
-    link = db.query(Link).filter(Link.id == link_id, Link.user_id == user_id).first()
+    link = (await db.execute(
+        select(Link).where(Link.id == link_id, Link.user_id == user_id)
+    )).scalar_one_or_none()
 
     if link is None:
         raise HTTPException(status_code=404, detail="Link not found")
 
-    db.delete(link)
-    db.commit()
+    await db.delete(link)
+    await db.commit()
 
     # Drop cache
     # noinspection PyAsyncCall
     redis.delete(link_cache_key)
+    publish_invalidation(redis, link_id)
 
     return Response(status_code=204)
@@ -1,13 +1,25 @@
 import redis
+import redis.asyncio
 
 from app.config import REDIS_HOST, REDIS_PORT, REDIS_DATABASE
 
 
+def create_async_redis():
+    return redis.asyncio.Redis(host=REDIS_HOST,
+                               port=REDIS_PORT,
+                               db=REDIS_DATABASE,
+                               decode_responses=True)
+
+
+def create_redis():
+    return redis.Redis(host=REDIS_HOST,
+                       port=REDIS_PORT,
+                       db=REDIS_DATABASE,
+                       decode_responses=True)
+
+
 def get_redis():
-    client = redis.Redis(host=REDIS_HOST,
-                         port=REDIS_PORT,
-                         db=REDIS_DATABASE,
-                         decode_responses=True)
+    client = create_redis()
     try:
         yield client
     finally:
@@ -1,8 +1,10 @@
+import asyncio
 from typing import List, Optional
 from datetime import datetime
 
-from sqlalchemy import create_engine, text, ForeignKey, String, DateTime, Integer
-from sqlalchemy.orm import declarative_base, sessionmaker, Mapped, mapped_column, relationship
+from sqlalchemy import text, ForeignKey, Index, String, DateTime, Integer
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
 
 from app.config import DATABASE_URL
 from app.utils import generate_short_code, generate_uuid4
@@ -22,8 +24,20 @@ class User(Base):
 
 class Link(Base):
     __tablename__ = "link"
-
-    id: Mapped[str] = mapped_column(String, primary_key=True, default=generate_short_code)
+    __table_args__ = (
+        # List/stats/update/delete all filter on (user_id, ...)
+        Index("ix_link_user_id", "user_id", "id"),
+        Index("ix_link_user_expire", "user_id", "expire_at"),
+        # pg_trgm GIN index makes the LIKE '%...%' search index-backed on
+        # Postgres; other dialects ignore the postgresql_* options
+        Index("ix_link_url_trgm", "url",
+              postgresql_using="gin",
+              postgresql_ops={"url": "gin_trgm_ops"}),
+    )
+
+    # Fixed-width key: generated codes are exactly 10 chars and aliases are
+    # capped at 10 by the API, keeping btree entries small on the hot lookup
+    id: Mapped[str] = mapped_column(String(10), primary_key=True, default=generate_short_code)
     user_id: Mapped[Optional[str]] = mapped_column(String, ForeignKey("user.id"), nullable=True)
     url: Mapped[str] = mapped_column(String)
 
@@ -37,29 +51,63 @@ class Link(Base):
     user: Mapped["User"] = relationship(back_populates="links")
 
 
-engine = create_engine(DATABASE_URL)
+POOL_SIZE = 20
+
+engine = create_async_engine(DATABASE_URL, pool_size=POOL_SIZE, max_overflow=0, query_cache_size=1200)
 
 # Get session constructor
-Session = sessionmaker(bind=engine)
+Session = async_sessionmaker(bind=engine, expire_on_commit=False)
 
+# Arbitrary application-wide key for the startup advisory lock
+_INIT_DB_LOCK_KEY = 874512
 
-def init_db():
-    Base.metadata.create_all(engine)
 
-    # ping the database
-    with Session() as session:
-        try:
-            session.execute(text("SELECT 1"))
-        except Exception as e:
-            print(f"Database connection error: {e}")
-            raise
-        else:
-            print("Database connection successful")
+async def _create_all(connection):
+    if connection.dialect.name == "postgresql":
+        # Required by the trigram index on link.url
+        await connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+    await connection.run_sync(Base.metadata.create_all)
+
+
+async def _warm_connection():
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
 
+async def init_db():
+    async with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Only one worker runs DDL at a time instead of all of them
+            # queueing up on the same DDL locks
+            locked = (await connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _INIT_DB_LOCK_KEY}
+            )).scalar()
 
-def get_db():
-    session = Session()
+            if locked:
+                await _create_all(connection)
+                await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _INIT_DB_LOCK_KEY})
+            else:
+                # Wait for the winning worker to finish before serving
+                await connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _INIT_DB_LOCK_KEY})
+                await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _INIT_DB_LOCK_KEY})
+        else:
+            await _create_all(connection)
+
+    # ping the database, warming one connection per pool slot in parallel
     try:
+        await asyncio.gather(*(_warm_connection() for _ in range(POOL_SIZE)))
+    except Exception as e:
+        print(f"Database connection error: {e}")
+        raise
+    else:
+        print("Database connection successful")
+
+
+async def close_db():
+    await engine.dispose()
+
+
+async def get_db():
+    async with Session() as session:
         yield session
-    finally:
-        session.close()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from contextlib import suppress
+from datetime import datetime
+from typing import Optional, Tuple
+
+import anyio.to_thread
+from redis import Redis
+from sqlalchemy import update, bindparam, func
+
+from app.config import STATS_FLUSH_SECONDS
+from app.redis import create_redis
+from app.sql import Session, Link
+
+# Pending access counters live in Redis hashes ("stat:{link_id}") and are
+# folded into the database in one batch, so the redirect hot path never pays
+# a per-request UPDATE + commit.
+
+# Executed on a Core connection: with a list of params the ORM session would
+# switch to its "bulk update by primary key" mode and reject the custom
+# bindparam WHERE clause
+_FLUSH_STMT = (
+    update(Link)
+    .where(Link.id == bindparam("link_id"))
+    .values(access_count=Link.access_count + bindparam("count"),
+            # A hash caught between its HINCRBY and HSET has a count but no
+            # "last" yet; coalesce keeps the stored timestamp in that case
+            last_access_at=func.coalesce(bindparam("last"), Link.last_access_at))
+)
+
+
+def stat_key(link_id: str) -> str:
+    return f"stat:{link_id}"
+
+
+def record_access(redis: Redis, link_id: str):
+    # MULTI/EXEC so a flush never observes the incremented count without the
+    # matching "last" timestamp
+    pipeline = redis.pipeline(transaction=True)
+    pipeline.hincrby(stat_key(link_id), "count", 1)
+    pipeline.hset(stat_key(link_id), "last", time.time())
+    pipeline.execute()
+
+
+def pending_stats(redis: Redis, link_id: str) -> Tuple[int, Optional[datetime]]:
+    """Return counters recorded since the last flush."""
+    values = redis.hgetall(stat_key(link_id))
+
+    count = int(values.get("count", 0))
+    last = datetime.fromtimestamp(float(values["last"])) if "last" in values else None
+
+    return count, last
+
+
+def _collect_pending():
+    """Read all pending counters from Redis (runs in a worker thread)."""
+    redis = create_redis()
+
+    try:
+        params = []
+        flushed = []
+        for key in redis.scan_iter(match="stat:*"):
+            values = redis.hgetall(key)
+
+            count = int(values.get("count", 0))
+            if count <= 0:
+                continue
+
+            flushed.append((key, count))
+            params.append({
+                "link_id": key.split(":", 1)[1],
+                "count": count,
+                "last": datetime.fromtimestamp(float(values["last"])) if "last" in values else None,
+            })
+
+        return params, flushed
+    finally:
+        redis.close()
+
+
+def _drop_flushed(flushed):
+    """Subtract the flushed counts (runs in a worker thread).
+
+    HINCRBY with the negated amount instead of DEL: hits recorded between the
+    collect and this call stay pending for the next round instead of being
+    wiped with the key.
+    """
+    redis = create_redis()
+
+    try:
+        for key, count in flushed:
+            if redis.hincrby(key, "count", -count) <= 0:
+                redis.delete(key)
+    finally:
+        redis.close()
+
+
+async def flush_stats():
+    """Fold all pending counters into the database in a single batch."""
+    params, flushed = await anyio.to_thread.run_sync(_collect_pending)
+
+    if not params:
+        return
+
+    async with Session() as session:
+        connection = await session.connection()
+        await connection.execute(_FLUSH_STMT, params)
+        await session.commit()
+
+    # Only drop the counters once they are safely committed; a failed flush
+    # leaves them in Redis for the next round
+    await anyio.to_thread.run_sync(_drop_flushed, flushed)
+
+
+async def flush_stats_loop():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_SECONDS)
+
+        try:
+            await flush_stats()
+        except Exception as e:
+            print(f"Link stats flush error: {e}")
+
+
+def start_stats_flusher() -> asyncio.Task:
+    return asyncio.create_task(flush_stats_loop())
+
+
+async def stop_stats_flusher(task: asyncio.Task):
+    task.cancel()
+
+    with suppress(asyncio.CancelledError):
+        await task
@@ -1,44 +1,50 @@
+import asyncio
+from datetime import datetime, timedelta
+
 import pytest
 from fakeredis import FakeRedis
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 
+from app import stats
 from app.main import app
 from app.redis import get_redis
-from app.sql import Base, get_db
+from app.sql import Base, get_db, Link
+
+# NullPool: every TestClient runs the app on its own event loop, so pooled
+# connections must not be carried over between tests
+TEST_DATABASE_URL = "sqlite+aiosqlite:///test_db.sqlite"
+engine = create_async_engine(TEST_DATABASE_URL, poolclass=NullPool)
+TestingSessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
-TEST_DATABASE_URL = "sqlite:///test_db.sqlite"
-engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async def _run_ddl(method):
+    async with engine.begin() as connection:
+        await connection.run_sync(method)
 
 
 @pytest.fixture(scope="session", autouse=True)
 def create_test_database():
-    Base.metadata.create_all(bind=engine)
+    asyncio.run(_run_ddl(Base.metadata.create_all))
     yield
-    Base.metadata.drop_all(bind=engine)
-
-
-@pytest.fixture
-def db_session():
-    session = TestingSessionLocal()
-    try:
-        yield session
-    finally:
-        session.close()
+    asyncio.run(_run_ddl(Base.metadata.drop_all))
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def fake_redis():
-    return FakeRedis()
+    # Session-scoped like the database: access counters recorded during the
+    # redirect tests must stay visible to the stats tests
+    return FakeRedis(decode_responses=True)
 
 
 @pytest.fixture
-def client(db_session, fake_redis):
+def client(fake_redis):
     # Dependency override for DB
-    def override_get_db():
-        yield db_session
+    async def override_get_db():
+        async with TestingSessionLocal() as session:
+            yield session
 
     # Dependency override for Redis
     def override_get_redis():
@@ -275,3 +281,65 @@ def test_delete_link(client, token_for_alice):
     stats_resp = client.get("/links/myalias/stats", headers={"Authorization": f"Bearer {token_for_alice}"})
     assert stats_resp.status_code == 404
     assert stats_resp.json()["detail"] == "Link not found"
+
+
+#
+# stats flushing
+#
+
+
+def test_flush_stats_updates_database(monkeypatch):
+    flush_redis = FakeRedis(decode_responses=True)
+    monkeypatch.setattr(stats, "create_redis", lambda: flush_redis)
+    monkeypatch.setattr(stats, "Session", TestingSessionLocal)
+
+    async def run():
+        async with TestingSessionLocal() as session:
+            session.add(Link(id="flushlink", url="https://www.example.com",
+                             expire_at=datetime.now() + timedelta(days=1)))
+            await session.commit()
+
+        stats.record_access(flush_redis, "flushlink")
+        stats.record_access(flush_redis, "flushlink")
+
+        await stats.flush_stats()
+
+        async with TestingSessionLocal() as session:
+            link = (await session.execute(select(Link).where(Link.id == "flushlink"))).scalar_one()
+
+            assert link.access_count == 2
+            assert link.last_access_at is not None
+
+        # Counters are dropped from Redis once committed
+        assert flush_redis.hgetall("stat:flushlink") == {}
+
+    asyncio.run(run())
+
+
+def test_flush_stats_without_last_keeps_timestamp(monkeypatch):
+    flush_redis = FakeRedis(decode_responses=True)
+    monkeypatch.setattr(stats, "create_redis", lambda: flush_redis)
+    monkeypatch.setattr(stats, "Session", TestingSessionLocal)
+
+    async def run():
+        recorded_at = datetime.now() - timedelta(minutes=5)
+
+        async with TestingSessionLocal() as session:
+            session.add(Link(id="flushlink2", url="https://www.example.com",
+                             expire_at=datetime.now() + timedelta(days=1),
+                             last_access_at=recorded_at))
+            await session.commit()
+
+        # A hash caught between its HINCRBY and HSET: a count without "last"
+        flush_redis.hincrby("stat:flushlink2", "count", 1)
+
+        await stats.flush_stats()
+
+        async with TestingSessionLocal() as session:
+            link = (await session.execute(select(Link).where(Link.id == "flushlink2"))).scalar_one()
+
+            assert link.access_count == 1
+            # The missing "last" must not overwrite the stored timestamp
+            assert link.last_access_at == recorded_at
+
+    asyncio.run(run())
@@ -1,11 +1,17 @@
 import string
+import time
+from datetime import datetime, timedelta
 from unittest.mock import MagicMock
 
+import jwt
 import pytest
+from fakeredis import FakeRedis
 from fastapi import HTTPException
-from jose import jwt
 
+from app import main, stats
+from app.cache import local_get, local_put, publish_invalidation
 from app.main import get_user_id
+from app.stats import record_access, pending_stats
 from app.utils import generate_short_code
 
 
@@ -40,13 +46,15 @@ JWT_SECRET_KEY = "test_secret"
 JWT_ALGORITHM = "HS256"
 
 
-def test_get_user_id_valid_token():
+def test_get_user_id_valid_token(monkeypatch):
     """Test get_user_id() with a valid token"""
+    monkeypatch.setattr(main, "_JWT_SECRET_KEY", JWT_SECRET_KEY.encode())
+
     token = jwt.encode({"sub": "user123"}, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     request = MagicMock()
     request.headers = {"Authorization": f"Bearer {token}"}
 
-    user_id = get_user_id(request, jwt_secret_key=JWT_SECRET_KEY, jwt_algorithm=JWT_ALGORITHM)
+    user_id = get_user_id(request)
 
     assert user_id == "user123"
 
@@ -71,6 +79,24 @@ def test_get_user_id_invalid_format():
     assert user_id is None
 
 
+def test_get_user_id_expired_token(monkeypatch):
+    """Test get_user_id() with an expired token, before and after caching"""
+    monkeypatch.setattr(main, "_JWT_SECRET_KEY", JWT_SECRET_KEY.encode())
+
+    token = jwt.encode({"sub": "user123", "exp": int(time.time()) - 60},
+                       JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    request = MagicMock()
+    request.headers = {"Authorization": f"Bearer {token}"}
+
+    # Same 401 whether the decode is fresh or served from the claims cache
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc_info:
+            get_user_id(request)
+
+        assert exc_info.value.status_code == 401
+        assert exc_info.value.detail == "Access token expired"
+
+
 def test_get_user_id_invalid_token():
     """Test get_user_id() when token is invalid"""
     request = MagicMock()
@@ -81,3 +107,66 @@ def test_get_user_id_invalid_token():
 
     assert exc_info.value.status_code == 401
     assert exc_info.value.detail == "Access token malformed"
+
+
+# Test cases for batched access stats
+
+def test_record_access_and_pending_stats():
+    """Test that record_access() counters are readable via pending_stats()"""
+    redis = FakeRedis(decode_responses=True)
+
+    record_access(redis, "abc")
+    record_access(redis, "abc")
+
+    count, last = pending_stats(redis, "abc")
+
+    assert count == 2
+    assert last is not None
+
+
+def test_pending_stats_empty():
+    """Test that pending_stats() returns zero for a link without hits"""
+    count, last = pending_stats(FakeRedis(decode_responses=True), "missing")
+
+    assert count == 0
+    assert last is None
+
+
+def test_drop_flushed_keeps_hits_recorded_during_flush(monkeypatch):
+    """Test that a hit landing between collect and drop stays pending"""
+    redis = FakeRedis(decode_responses=True)
+    monkeypatch.setattr(stats, "create_redis", lambda: redis)
+
+    record_access(redis, "abc")
+    record_access(redis, "abc")
+
+    params, flushed = stats._collect_pending()
+    assert params[0]["count"] == 2
+
+    # A hit lands while the batch is being written to the database
+    record_access(redis, "abc")
+
+    stats._drop_flushed(flushed)
+
+    count, last = pending_stats(redis, "abc")
+    assert count == 1
+    assert last is not None
+
+
+# Test cases for the process-local link cache
+
+def test_publish_invalidation_drops_local_entry():
+    """Test that publish_invalidation() evicts the local cache entry"""
+    local_put("abc", "https://www.example.com", datetime.now() + timedelta(days=1))
+    assert local_get("abc") == "https://www.example.com"
+
+    publish_invalidation(FakeRedis(decode_responses=True), "abc")
+
+    assert local_get("abc") is None
+
+
+def test_local_get_expired_link():
+    """Test that local_get() does not serve a link past its expire_at"""
+    local_put("exp", "https://www.example.com", datetime.now() - timedelta(seconds=1))
+
+    assert local_get("exp") is None